@@ -1,30 +1,90 @@
 
 import argparse
+import os
 import socket
 import time
 import threading
 
+SOCK_BUF_BYTES = 4 * 1024 * 1024
+HAS_QUICKACK = hasattr(socket, "TCP_QUICKACK")  # Linux only
+BATCH = 64  # requests pipelined per round trip
+try:
+    IOV_MAX = os.sysconf("SC_IOV_MAX")  # buffers one sendmsg() accepts (1024 on Linux)
+except (AttributeError, ValueError, OSError):
+    IOV_MAX = -1
+if IOV_MAX <= 0:  # not reported: assume the POSIX/Linux value
+    IOV_MAX = 1024
 
-def bench_set(n: int, host="127.0.0.1", port=9000):
+
+def connect(host: str, port: int) -> socket.socket:
     s = socket.create_connection((host, port))
     s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCK_BUF_BYTES)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCK_BUF_BYTES)
+    return s
+
+
+def quickack(s: socket.socket):
+    # Linux clears TCP_QUICKACK after ACKs go out, so re-arm it every round trip
+    if HAS_QUICKACK:
+        s.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
+
+
+def send_batch(s: socket.socket, cmds: list):
+    # one gathered syscall per IOV_MAX commands (usually the whole batch);
+    # finish each with sendall on a short write
+    for base in range(0, len(cmds), IOV_MAX):
+        group = cmds[base:base + IOV_MAX]
+        sent = s.sendmsg(group)
+        if sent < sum(map(len, group)):
+            s.sendall(b"".join(group)[sent:])
+
+
+def read_replies(s: socket.socket, count: int, buf: bytearray):
+    """Consume `count` replies; buf carries any bytes read past the last one."""
+    pos = 0
+    while count:
+        nl = buf.find(b"\n", pos)
+        end = nl + 1
+        if nl >= 0 and buf.startswith(b"VALUE ", pos):
+            end += int(buf[pos + 6:nl]) + 1  # payload + trailing '\n'
+        if nl < 0 or len(buf) < end:
+            data = s.recv(1 << 16)
+            if not data:
+                raise ConnectionError("server closed connection")
+            buf += data
+            continue
+        pos = end
+        count -= 1
+    del buf[:pos]
+
+
+def bench_set(n: int, host="127.0.0.1", port=9000, batch=BATCH):
+    payload = b"value\n"
+    cmds = [b"SET k%d 0 %d\n" % (i, len(payload) - 1) + payload for i in range(n)]
+    s = connect(host, port)
+    buf = bytearray()
     start = time.time()
-    for i in range(n):
-        payload = b"value\n"
-        s.sendall(f"SET k{i} 0 {len(payload)-1}\n".encode() + payload)
-        s.recv(16)  # "OK\n"
+    for base in range(0, n, batch):
+        chunk = cmds[base:base + batch]
+        send_batch(s, chunk)
+        read_replies(s, len(chunk), buf)  # "OK\n" each
+        quickack(s)
     elapsed = time.time() - start
     s.close()
     return n / elapsed, elapsed
 
 
-def bench_get(n: int, host="127.0.0.1", port=9000):
-    s = socket.create_connection((host, port))
-    s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+def bench_get(n: int, host="127.0.0.1", port=9000, batch=BATCH):
+    cmds = [b"GET k%d\n" % i for i in range(n)]
+    s = connect(host, port)
+    buf = bytearray()
     start = time.time()
-    for i in range(n):
-        s.sendall(f"GET k{i}\n".encode())
-        s.recv(64)  # small values
+    for base in range(0, n, batch):
+        chunk = cmds[base:base + batch]
+        send_batch(s, chunk)
+        read_replies(s, len(chunk), buf)
+        quickack(s)
     elapsed = time.time() - start
     s.close()
     return n / elapsed, elapsed
@@ -35,9 +95,10 @@ if __name__ == "__main__":
     ap.add_argument("--n", type=int, default=10000)
     ap.add_argument("--host", default="127.0.0.1")
     ap.add_argument("--port", type=int, default=9000)
+    ap.add_argument("--batch", type=int, default=BATCH, help="requests pipelined per round trip")
     args = ap.parse_args()
 
-    rps_set, t_set = bench_set(args.n, args.host, args.port)
-    rps_get, t_get = bench_get(args.n, args.host, args.port)
+    rps_set, t_set = bench_set(args.n, args.host, args.port, args.batch)
+    rps_get, t_get = bench_get(args.n, args.host, args.port, args.batch)
     print(f"SET: {args.n} ops in {t_set:.2f}s -> {rps_set:.0f} ops/s")
     print(f"GET: {args.n} ops in {t_get:.2f}s -> {rps_get:.0f} ops/s")
@@ -0,0 +1,40 @@
+# Optional compiled build of cache.py (Cython "augmenting .pxd", pure-Python mode).
+#   cythonize -i cache.py
+# turns CacheEntry / LRUCache into cdef classes with typed fields; the resulting
+# extension module is imported in preference to cache.py, which stays the
+# pure-Python fallback and the single source of truth.
+
+cdef long long _deadline_ns(double ttl_sec) except? -1
+
+
+cdef class CacheEntry:
+    cdef public bytes key
+    cdef public object value
+    cdef public long long expire_at_ns
+    cdef public Py_ssize_t size
+    cdef public dict slot
+
+
+cdef class LRUCache:
+    cdef public Py_ssize_t capacity_bytes
+    cdef public Py_ssize_t bytes
+    cdef public object data
+    cdef public Py_ssize_t hits
+    cdef public Py_ssize_t misses
+    cdef public Py_ssize_t sets
+    cdef public Py_ssize_t evictions
+    cdef public Py_ssize_t expired
+    cdef list _wheels
+    cdef long long _tick
+    cdef readonly object _due
+    cdef readonly Py_ssize_t _timers
+    cdef public object lock
+
+    cpdef _amortize_expire(self, Py_ssize_t limit=*)
+    cdef long long _next_event(self, long long tick)
+    cdef _advance(self)
+    cdef _cascade(self, int level, int idx)
+    cdef _schedule(self, CacheEntry e)
+    cdef inline _unschedule(self, CacheEntry e)
+    cdef list _evict_if_needed(self)
+    cdef inline _remove_entry(self, CacheEntry e)
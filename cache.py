@@ -1,36 +1,62 @@
-
+# cython: annotation_typing=False
 import time
-import heapq
 import threading
-from typing import Optional, Dict, Tuple
+from collections import OrderedDict, deque
+from typing import Optional, Deque, Dict, List, Tuple, Union
+
+Key = Union[bytes, str]  # stored as bytes; str is encoded on entry
+Value = Union[bytes, memoryview]  # large protocol payloads are kept as read-only views
+
+# Hierarchical timing wheel: 4 wheels x 64 slots at 10 ms resolution covers
+# 64**4 ticks (~46 h); longer TTLs park in the top wheel and re-cascade.
+TICK_NS = 10_000_000
+WHEEL_BITS = 6
+WHEEL_SIZE = 1 << WHEEL_BITS
+WHEEL_MASK = WHEEL_SIZE - 1
+NUM_WHEELS = 4
+MAX_TICKS = 1 << (WHEEL_BITS * NUM_WHEELS)
+NEVER = (1 << 63) - 1  # expire_at_ns for entries without a TTL
+EXPIRE_PER_SET = 8  # due entries reclaimed inline by each SET
+
+
+def _deadline_ns(ttl_sec: float) -> int:
+    """expire_at_ns for a TTL from now; TTLs past the clock's range (~292 years) never expire."""
+    if not ttl_sec > 0:
+        return NEVER
+    ttl_ns = ttl_sec * 1e9
+    if ttl_ns >= NEVER:  # checked as a float first, so inf never reaches int()
+        return NEVER
+    return min(time.monotonic_ns() + int(ttl_ns), NEVER)  # stays within int64 when compiled
 
 
 class CacheEntry:
-    __slots__ = ("key", "value", "expire_at", "prev", "next", "size", "version")
+    __slots__ = ("key", "value", "expire_at_ns", "size", "slot")
 
-    def __init__(self, key: str, value: bytes, ttl_sec: float, version: int):
+    def __init__(self, key: bytes, value: Value, ttl_sec: float):
         self.key = key
         self.value = value
-        self.expire_at = (time.time() + ttl_sec) if ttl_sec > 0 else float("inf")
-        self.prev: Optional["CacheEntry"] = None
-        self.next: Optional["CacheEntry"] = None
-        self.size = len(key.encode()) + len(value)
-        self.version = version  # increments on each SET for lazy heap invalidation
+        self.expire_at_ns = _deadline_ns(ttl_sec)
+        self.size = len(key) + len(value)
+        self.slot: Optional[Dict[bytes, "CacheEntry"]] = None  # timer wheel slot holding this entry
 
 
 class LRUCache:
     """
     LRU + TTL, capacity by bytes.
-    - map: key -> entry
-    - doubly linked list for LRU ordering
-    - expiry min-heap of (expire_at, version, key) with lazy deletion
+    - data: OrderedDict bytes key -> entry in LRU order (LRU first, MRU last);
+      promotion and eviction are C-level move_to_end / popitem
+    - expiry via a hierarchical timing wheel; each entry knows its slot, so
+      schedule / cancel / expire are all O(1). There is no sweeper thread:
+      each set() reclaims a few due entries and get() checks expiry lazily
+    - plain (non-reentrant) Lock: public methods take it exactly once; the
+      underscore helpers below assume the caller already holds it
+    - values are stored as given: get() returns a read-only memoryview for
+      large payloads set over the protocol (bytes(v) copies), bytes otherwise
     """
     def __init__(self, capacity_bytes: int = 64 * 1024 * 1024):
         self.capacity_bytes = capacity_bytes
         self.bytes = 0
-        self.map: Dict[str, CacheEntry] = {}
-        self.head: Optional[CacheEntry] = None  # MRU
-        self.tail: Optional[CacheEntry] = None  # LRU
+        self.data: "OrderedDict[bytes, CacheEntry]" = OrderedDict()
 
         # stats
         self.hits = 0
@@ -39,150 +65,199 @@ class LRUCache:
         self.evictions = 0
         self.expired = 0
 
-        # expiry heap
-        self._heap: list[Tuple[float, int, str]] = []
-        self._version_counter = 0
+        # timing wheel: _wheels[level][slot] is a dict key -> entry
+        self._wheels: List[List[Dict[bytes, CacheEntry]]] = [
+            [{} for _ in range(WHEEL_SIZE)] for _ in range(NUM_WHEELS)
+        ]
+        self._tick = time.monotonic_ns() // TICK_NS  # next tick to process
+        self._due: Deque[Dict[bytes, CacheEntry]] = deque()  # drained wheel-0 slots
+        self._timers = 0  # entries currently scheduled or due
 
         # lock
-        self.lock = threading.RLock()
+        self.lock = threading.Lock()
 
-        # background expiry
-        self._stop = False
-        self._sweeper = threading.Thread(target=self._sweeper_loop, daemon=True)
-        self._sweeper.start()
+    def _amortize_expire(self, limit: int = EXPIRE_PER_SET):
+        """Advance the wheel to now and expire at most `limit` due entries."""
+        if not self._timers:
+            return  # no clock read at all when nothing carries a TTL
+        now = time.monotonic_ns()
+        target = now // TICK_NS
+        steps = limit  # non-empty slots processed per call; empty ticks are free
+        while self._tick <= target and steps:
+            tick = self._next_event(self._tick)
+            if tick > target:
+                self._tick = target + 1  # nothing fires before now
+                break
+            self._tick = tick
+            self._advance()
+            steps -= 1
+        while self._due and limit:
+            slot = self._due[0]
+            if not slot:
+                self._due.popleft()
+                continue
+            _, e = slot.popitem()
+            e.slot = None
+            self._timers -= 1
+            if e.expire_at_ns <= now:
+                self._remove_entry(e)
+                self.expired += 1
+                limit -= 1
+            else:
+                self._schedule(e)
 
-    def close(self):
-        self._stop = True
+    def _next_event(self, tick: int) -> int:
+        """First tick >= `tick` at which _advance() finds a non-empty slot (NEVER if none)."""
+        best = NEVER
+        for level in range(NUM_WHEELS):
+            shift = WHEEL_BITS * level
+            first = -(-tick >> shift) << shift  # this wheel's next rollover (any tick for wheel 0)
+            if first >= best:
+                break  # higher wheels only act at or after this point
+            wheel = self._wheels[level]
+            base = (first >> shift) & WHEEL_MASK
+            for k in range(WHEEL_SIZE):
+                if wheel[(base + k) & WHEEL_MASK]:
+                    best = min(best, first + (k << shift))
+                    break
+        return best
 
-    def _sweeper_loop(self):
-        while not self._stop:
-            self._sweep_expired_budget(0.01)  # sweep a few items very cheaply
-            time.sleep(0.05)
+    def _advance(self):
+        """Process tick self._tick: cascade higher wheels on rollover, then queue wheel 0's slot."""
+        tick = self._tick
+        if not tick & WHEEL_MASK:
+            for level in range(NUM_WHEELS - 1, 0, -1):
+                if not tick & ((1 << (WHEEL_BITS * level)) - 1):
+                    self._cascade(level, (tick >> (WHEEL_BITS * level)) & WHEEL_MASK)
+        idx = tick & WHEEL_MASK
+        slot = self._wheels[0][idx]
+        if slot:
+            # entries keep pointing at this dict, so they can still be cancelled while due
+            self._wheels[0][idx] = {}
+            self._due.append(slot)
+        self._tick = tick + 1
 
-    def _sweep_expired_budget(self, budget_sec: float = 0.01):
-        deadline = time.time() + budget_sec
-        with self.lock:
-            now = time.time()
-            while self._heap and time.time() < deadline:
-                expire_at, version, key = self._heap[0]
-                if expire_at > now:
-                    break
-                heapq.heappop(self._heap)
-                e = self.map.get(key)
-                if not e or e.version != version:
-                    # stale heap node
-                    continue
-                if e.expire_at <= now:
-                    self._remove_entry(e)
-                    self.expired += 1
-
-    def _push_expiry(self, e: CacheEntry):
-        if e.expire_at != float("inf"):
-            heapq.heappush(self._heap, (e.expire_at, e.version, e.key))
-
-    def _bump_version(self) -> int:
-        self._version_counter += 1
-        return self._version_counter
-
-    def get(self, key: str) -> Optional[bytes]:
+    def _cascade(self, level: int, idx: int):
+        slot = self._wheels[level][idx]
+        if not slot:
+            return
+        self._wheels[level][idx] = {}
+        self._timers -= len(slot)
+        for e in slot.values():
+            e.slot = None
+            self._schedule(e)  # into a lower wheel (or the current tick if already due)
+
+    def _schedule(self, e: CacheEntry):
+        if e.expire_at_ns == NEVER:
+            return
+        if not self._timers:
+            # wheel is empty; jump the cursor to now instead of walking idle ticks
+            self._tick = max(self._tick, time.monotonic_ns() // TICK_NS + 1)
+        # first tick that starts after expire_at_ns, so draining it never fires early
+        t = e.expire_at_ns // TICK_NS + 1
+        delta = t - self._tick
+        if delta < 0:
+            t, delta = self._tick, 0
+        elif delta >= MAX_TICKS:
+            t, delta = self._tick + MAX_TICKS - 1, MAX_TICKS - 1
+        level = 0
+        while delta >= WHEEL_SIZE:
+            delta >>= WHEEL_BITS
+            level += 1
+        slot = self._wheels[level][(t >> (WHEEL_BITS * level)) & WHEEL_MASK]
+        slot[e.key] = e
+        e.slot = slot
+        self._timers += 1
+
+    def _unschedule(self, e: CacheEntry):
+        if e.slot is not None:
+            del e.slot[e.key]
+            e.slot = None
+            self._timers -= 1
+
+    def get(self, key: Key) -> Optional[Value]:
+        if isinstance(key, str):
+            key = key.encode()
         with self.lock:
-            e = self.map.get(key)
+            e = self.data.get(key)
             if not e:
                 self.misses += 1
                 return None
-            if e.expire_at <= time.time():
+            # NEVER short-circuits, so entries without a TTL cost no clock read
+            if e.expire_at_ns != NEVER and e.expire_at_ns <= time.monotonic_ns():
                 self._remove_entry(e)
                 self.misses += 1
                 self.expired += 1
                 return None
-            self._move_to_head(e)
+            self.data.move_to_end(key)
             self.hits += 1
             return e.value
 
-    def set(self, key: str, value: bytes, ttl_sec: float = 0.0):
+    def set(self, key: Key, value: Value, ttl_sec: float = 0.0):
+        if isinstance(key, str):
+            key = key.encode()
         with self.lock:
-            e = self.map.get(key)
+            self._amortize_expire()
+            e = self.data.get(key)
             if e:
-                # update existing
+                # update existing; the deadline is computed before e changes
+                expire_at_ns = _deadline_ns(ttl_sec)
                 old_size = e.size
                 e.value = value
-                e.size = len(key.encode()) + len(value)
+                e.size = len(key) + len(value)
                 self.bytes += (e.size - old_size)
-                e.version = self._bump_version()
-                e.expire_at = (time.time() + ttl_sec) if ttl_sec > 0 else float("inf")
-                self._move_to_head(e)
-                self._push_expiry(e)
+                self._unschedule(e)
+                e.expire_at_ns = expire_at_ns
+                self.data.move_to_end(key)
+                self._schedule(e)
             else:
-                e = CacheEntry(key, value, ttl_sec, self._bump_version())
-                self.map[key] = e
-                self._add_to_head(e)
+                e = CacheEntry(key, value, ttl_sec)
+                self.data[key] = e  # new keys land at the MRU end
                 self.bytes += e.size
-                self._push_expiry(e)
+                self._schedule(e)
 
             self.sets += 1
-            self._evict_if_needed()
+            victims = self._evict_if_needed()
+        # evicted values (possibly large buffers) are freed here, outside the lock
+        del victims
 
-    def delete(self, key: str) -> int:
+    def delete(self, key: Key) -> int:
+        if isinstance(key, str):
+            key = key.encode()
         with self.lock:
-            e = self.map.get(key)
+            e = self.data.get(key)
             if not e:
                 return 0
             self._remove_entry(e)
             return 1
 
+    @property
+    def max_entry_bytes(self) -> int:
+        """Largest len(key) + len(value) that can be stored; anything bigger evicts itself."""
+        return self.capacity_bytes
+
     # --- internal LRU + eviction helpers ---
-    def _evict_if_needed(self):
-        while self.bytes > self.capacity_bytes and self.tail:
-            victim = self.tail
-            self._remove_entry(victim)
+    def _evict_if_needed(self) -> List[CacheEntry]:
+        """Unlink LRU entries until within capacity; the caller drops them after unlocking."""
+        victims = []
+        while self.bytes > self.capacity_bytes and self.data:
+            _, victim = self.data.popitem(last=False)  # LRU end
+            self._unschedule(victim)
+            self.bytes -= victim.size
             self.evictions += 1
+            victims.append(victim)
+        return victims
 
     def _remove_entry(self, e: CacheEntry):
-        if e.key in self.map:
-            del self.map[e.key]
+        del self.data[e.key]
+        self._unschedule(e)
         self.bytes -= e.size
-        # unlink
-        if e.prev:
-            e.prev.next = e.next
-        if e.next:
-            e.next.prev = e.prev
-        if self.head is e:
-            self.head = e.next
-        if self.tail is e:
-            self.tail = e.prev
-        e.prev = e.next = None
-
-    def _add_to_head(self, e: CacheEntry):
-        e.prev = None
-        e.next = self.head
-        if self.head:
-            self.head.prev = e
-        self.head = e
-        if self.tail is None:
-            self.tail = e
-
-    def _move_to_head(self, e: CacheEntry):
-        if self.head is e:
-            return
-        # unlink
-        if e.prev:
-            e.prev.next = e.next
-        if e.next:
-            e.next.prev = e.prev
-        if self.tail is e:
-            self.tail = e.prev
-        # link front
-        e.prev = None
-        e.next = self.head
-        if self.head:
-            self.head.prev = e
-        self.head = e
 
     # --- stats ---
     def stats(self):
         with self.lock:
             return {
-                "keys": len(self.map),
+                "keys": len(self.data),
                 "bytes": self.bytes,
                 "capacity": self.capacity_bytes,
                 "hits": self.hits,
@@ -191,3 +266,56 @@ class LRUCache:
                 "evictions": self.evictions,
                 "expired": self.expired,
             }
+
+
+class ShardedCache:
+    """
+    Lock-striped cache: N independent LRUCache shards, each with its own lock,
+    LRU order and timing wheel. A key always lives in shard hash(key) & (N-1),
+    so LRU order and capacity are per shard (approximate LRU overall).
+    """
+    def __init__(self, capacity_bytes: int = 64 * 1024 * 1024, shards: int = 16):
+        if shards <= 0 or shards & (shards - 1):
+            raise ValueError("shards must be a power of two")
+        self.capacity_bytes = capacity_bytes
+        self.shards: Tuple[LRUCache, ...] = tuple(
+            LRUCache(capacity_bytes // shards) for _ in range(shards)
+        )
+        self._mask = shards - 1
+
+    def _shard(self, key: bytes) -> LRUCache:
+        return self.shards[hash(key) & self._mask]
+
+    @property
+    def max_entry_bytes(self) -> int:
+        """An entry has to fit in one shard; all shards have the same capacity."""
+        return self.shards[0].max_entry_bytes
+
+    def get(self, key: Key) -> Optional[Value]:
+        if isinstance(key, str):
+            key = key.encode()
+        return self._shard(key).get(key)
+
+    def set(self, key: Key, value: Value, ttl_sec: float = 0.0):
+        if isinstance(key, str):
+            key = key.encode()
+        self._shard(key).set(key, value, ttl_sec)
+
+    def delete(self, key: Key) -> int:
+        if isinstance(key, str):
+            key = key.encode()
+        return self._shard(key).delete(key)
+
+    def stats(self):
+        total = {"keys": 0, "bytes": 0, "capacity": self.capacity_bytes, "hits": 0,
+                 "misses": 0, "sets": 0, "evictions": 0, "expired": 0}
+        for shard in self.shards:
+            with shard.lock:  # each shard locked separately
+                total["keys"] += len(shard.data)
+                total["bytes"] += shard.bytes
+                total["hits"] += shard.hits
+                total["misses"] += shard.misses
+                total["sets"] += shard.sets
+                total["evictions"] += shard.evictions
+                total["expired"] += shard.expired
+        return total
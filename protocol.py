@@ -1,66 +1,167 @@
 
-import json
-from typing import Optional
+from typing import Callable, Iterable, List, Optional
 from cache import LRUCache
 
+RECV_CHUNK = 64 * 1024  # largest window handed to a single recv
+BUF_INIT = 4 * 1024  # allocated on first read; drained buffers shrink back to it
+ZERO_COPY_MIN = 16 * 1024  # payloads this large are received into their own buffer
+OUT_FLUSH = 256 * 1024  # flush queued replies early once they reach this many value bytes
+_STATS_TMPL = (b'STATS {"keys":%d,"bytes":%d,"capacity":%d,"hits":%d,"misses":%d,'
+               b'"sets":%d,"evictions":%d,"expired":%d}\n')
+
 
 class ProtocolHandler:
     """
-    Incremental parser; does not call recv() itself. You feed raw bytes via on_data().
+    Incremental parser; does not call recv() itself. The transport reads straight
+    into get_buffer() and reports how much arrived via buffer_updated(); on_data()
+    copies in raw bytes for callers that already hold them.
+    buf[rpos:wpos] is received but unparsed; buf stays empty until the first read,
+    so idle connections hold no receive memory. A SET payload of ZERO_COPY_MIN bytes
+    or more is instead received into a buffer of its own, which the cache then
+    keeps as a read-only memoryview -- no copy out of the recv buffer. That buffer
+    grows with the bytes actually received, never ahead of them on the client's
+    word; a SET whose key + payload exceed cache.max_entry_bytes gets ERR and its
+    payload is discarded as it arrives.
     Protocol:
       SET <key> <ttl_ms> <nbytes>\n<payload><\n>
       GET <key>\n
       DEL <key>\n
       STATS\n
+    Replies are queued while a read is parsed and handed to send_func once per
+    read, as a list of buffers for a single gathered (writev/sendmsg-style)
+    write, so pipelined requests cost one send and payloads are never concatenated.
+    Large replies are flushed early, and while `paused` is set (the transport's
+    send buffer is full) parsing stops, leaving the rest of the input buffered
+    until resume() is called.
     """
-    def __init__(self, cache: LRUCache, send_func):
+    def __init__(self, cache: LRUCache, send_func: Callable[[Iterable[bytes]], None]):
         self.cache = cache
         self.send = send_func
         self.buf = bytearray()
+        self.rpos = 0
+        self.wpos = 0
         self.state = "READ_LINE"
         self._pending = None  # type: Optional[dict]
+        self._value = None  # type: Optional[bytearray]
+        self._vpos = 0
+        self._skip = 0  # payload bytes (incl. '\n') still to discard in SKIP_VALUE
+        self._out: List[bytes] = []  # replies queued until the end of this read
+        self._out_bytes = 0  # value bytes in _out
+        self.paused = False
+
+    def get_buffer(self, sizehint: int = -1) -> memoryview:
+        """Writable window after wpos, at most RECV_CHUNK bytes."""
+        if self.state == "READ_VALUE_DIRECT":
+            # the main buffer is drained; recv the rest of the payload in place
+            if self._vpos == len(self._value):
+                self._grow_value()
+            return memoryview(self._value)[self._vpos:]
+        if self.rpos == self.wpos:
+            self.rpos = self.wpos = 0
+            if len(self.buf) != BUF_INIT:
+                # first read, or a burst grew the buffer: (re)start small
+                self.buf = bytearray(BUF_INIT)
+        elif self.rpos >= len(self.buf) >> 1:
+            # rebase unread bytes to the front; same-length slice assignment
+            # never resizes, so it is safe with outstanding memoryviews
+            n = self.wpos - self.rpos
+            self.buf[:n] = self.buf[self.rpos:self.wpos]
+            self.rpos, self.wpos = 0, n
+        if len(self.buf) - self.wpos < len(self.buf) >> 2:
+            # under a quarter free: double, so bulk input is not read in slivers
+            n = self.wpos - self.rpos
+            grown = bytearray(len(self.buf) * 2)
+            grown[:n] = self.buf[self.rpos:self.wpos]
+            self.buf, self.rpos, self.wpos = grown, 0, n
+        return memoryview(self.buf)[self.wpos:self.wpos + RECV_CHUNK]
+
+    def buffer_updated(self, nbytes: int):
+        """nbytes were written into the window last returned by get_buffer()."""
+        if self.state == "READ_VALUE_DIRECT":
+            self._vpos += nbytes
+            self.on_data_end(self.wpos)
+        else:
+            self.on_data_end(self.wpos + nbytes)
 
     def on_data(self, data: bytes):
-        self.buf.extend(data)
-        while True:
+        view = memoryview(data)
+        while view:
+            dst = self.get_buffer()
+            n = min(len(dst), len(view))
+            dst[:n] = view[:n]
+            view = view[n:]
+            self.buffer_updated(n)
+
+    def on_data_end(self, new_end: int):
+        self.wpos = new_end
+        self._parse()
+        self._flush()
+
+    def resume(self):
+        """Output drained: continue with input left buffered while paused."""
+        self.paused = False
+        self.on_data_end(self.wpos)
+
+    def _flush(self):
+        if self._out:
+            out, self._out = self._out, []
+            self._out_bytes = 0
+            self.send(out)  # may set self.paused via the transport's pause_writing
+
+    def _parse(self):
+        while not self.paused:
             if self.state == "READ_LINE":
                 nl = self._find_newline()
                 if nl < 0:
                     return
-                line = self._consume(nl).decode("utf-8", errors="replace").strip()
-                self._consume(1)  # the '\n'
-                if not line:
+                parts = self._consume(nl - self.rpos).split()
+                self.rpos += 1  # the '\n'
+                if not parts:
                     continue
-                self._handle_line(line)
+                self._handle_line(parts)
+                if self._out_bytes >= OUT_FLUSH:
+                    self._flush()
 
             elif self.state == "READ_VALUE":
                 need = self._pending["nbytes"] + 1  # payload + trailing '\n'
-                if len(self.buf) < need:
+                if self.wpos - self.rpos < need:
                     return
                 value = self._consume(self._pending["nbytes"])
-                trailing = self._consume(1)
-                if trailing != b"\n":
-                    self.send(b"ERR protocol: missing newline after payload\n")
-                    self.state = "READ_LINE"
-                    self._pending = None
-                    continue
-                # apply SET
-                ttl_ms = self._pending["ttl_ms"]
-                key = self._pending["key"]
-                self.cache.set(key, bytes(value), ttl_ms / 1000.0)
-                self.send(b"OK\n")
+                self.rpos += 1
+                self._apply_set(value, self.buf[self.rpos - 1] == 0x0A)
+
+            elif self.state == "READ_VALUE_DIRECT":
+                # bytes that arrived alongside the SET line go in first
+                need = self._pending["nbytes"] + 1
+                while self.rpos < self.wpos and self._vpos < need:
+                    if self._vpos == len(self._value):
+                        self._grow_value()
+                    n = min(self.wpos - self.rpos, len(self._value) - self._vpos)
+                    memoryview(self._value)[self._vpos:self._vpos + n] = memoryview(self.buf)[self.rpos:self.rpos + n]
+                    self._vpos += n
+                    self.rpos += n
+                if self._vpos < need:
+                    return
+                value, self._value = self._value, None  # exactly `need` bytes long
+                self._apply_set(memoryview(value)[:-1].toreadonly(), value[-1] == 0x0A)
+
+            elif self.state == "SKIP_VALUE":
+                n = min(self.wpos - self.rpos, self._skip)
+                self.rpos += n
+                self._skip -= n
+                if self._skip:
+                    return
                 self.state = "READ_LINE"
-                self._pending = None
 
             else:
                 # reset if unknown
                 self.state = "READ_LINE"
 
-    def _handle_line(self, line: str):
-        parts = line.split()
-        cmd = parts[0].upper()
+    def _handle_line(self, parts: List[bytes]):
+        # commands are ASCII and case-sensitive; keys stay raw bytes
+        cmd = parts[0]
 
-        if cmd == "SET" and len(parts) == 4:
+        if cmd == b"SET" and len(parts) == 4:
             key = parts[1]
             try:
                 ttl_ms = int(parts[2])
@@ -68,39 +169,70 @@ class ProtocolHandler:
                 if nbytes < 0:
                     raise ValueError
             except ValueError:
-                self.send(b"ERR invalid SET args\n"); return
+                self._out.append(b"ERR invalid SET args\n"); return
+            if len(key) + nbytes > self.cache.max_entry_bytes:
+                # could never be stored; swallow the payload to stay in sync
+                self._out.append(b"ERR value too large\n")
+                self._skip = nbytes + 1
+                self.state = "SKIP_VALUE"
+                return
             self._pending = {"key": key, "ttl_ms": ttl_ms, "nbytes": nbytes}
-            self.state = "READ_VALUE"
+            if nbytes >= ZERO_COPY_MIN:
+                # payload + trailing '\n'; sized by what arrives, see _grow_value()
+                self._value = bytearray(min(nbytes + 1, RECV_CHUNK))
+                self._vpos = 0
+                self.state = "READ_VALUE_DIRECT"
+            else:
+                self.state = "READ_VALUE"
             return
 
-        if cmd == "GET" and len(parts) == 2:
+        if cmd == b"GET" and len(parts) == 2:
             val = self.cache.get(parts[1])
             if val is None:
-                self.send(b"NOT_FOUND\n")
+                self._out.append(b"NOT_FOUND\n")
             else:
-                self.send(f"VALUE {len(val)}\n".encode() + val + b"\n")
+                self._out += (b"VALUE %d\n" % len(val), val, b"\n")
+                self._out_bytes += len(val)
             return
 
-        if cmd == "DEL" and len(parts) == 2:
+        if cmd == b"DEL" and len(parts) == 2:
             n = self.cache.delete(parts[1])
-            self.send(f"DELETED {n}\n".encode())
+            self._out.append(b"DELETED %d\n" % n)
             return
 
-        if cmd == "STATS" and len(parts) == 1:
-            s = json.dumps(self.cache.stats(), separators=(",", ":"))
-            self.send(f"STATS {s}\n".encode())
+        if cmd == b"STATS" and len(parts) == 1:
+            s = self.cache.stats()
+            self._out.append(_STATS_TMPL % (s["keys"], s["bytes"], s["capacity"], s["hits"],
+                                            s["misses"], s["sets"], s["evictions"], s["expired"]))
             return
 
-        self.send(b"ERR unknown or invalid command\n")
+        self._out.append(b"ERR unknown or invalid command\n")
+
+    def _apply_set(self, value, trailing_ok: bool):
+        pending = self._pending
+        self.state = "READ_LINE"
+        self._pending = None
+        if not trailing_ok:
+            self._out.append(b"ERR protocol: missing newline after payload\n")
+            return
+        self.cache.set(pending["key"], value, pending["ttl_ms"] / 1000.0)
+        self._out.append(b"OK\n")
 
     # --- buffer helpers ---
+    def _grow_value(self):
+        """Grow the full direct-receive buffer 4x, up to the announced payload + '\n'."""
+        need = self._pending["nbytes"] + 1
+        size = len(self._value) * 4
+        if need - size < len(self._value):
+            size = need  # don't leave a sliver (e.g. just the '\n') for one more copy
+        grown = bytearray(size)
+        memoryview(grown)[:self._vpos] = memoryview(self._value)[:self._vpos]
+        self._value = grown
+
     def _find_newline(self) -> int:
-        try:
-            return self.buf.index(0x0A)  # '\n'
-        except ValueError:
-            return -1
+        return self.buf.find(b"\n", self.rpos, self.wpos)
 
     def _consume(self, n: int) -> bytes:
-        out = bytes(self.buf[:n])
-        del self.buf[:n]
+        out = bytes(memoryview(self.buf)[self.rpos:self.rpos + n])
+        self.rpos += n
         return out
@@ -1,42 +1,185 @@
 
 import argparse
+import asyncio
+import ctypes
+import os
+import signal
 import socket
-import threading
-from cache import LRUCache
+import sys
+import traceback
+from cache import ShardedCache
 from protocol import ProtocolHandler
 
+try:
+    import uvloop
+except ImportError:  # optional; falls back to the stdlib event loop
+    uvloop = None
 
-def handle_client(cache: LRUCache, conn: socket.socket, addr):
-    conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
-    def send(data: bytes):
+SOCK_BUF_BYTES = 4 * 1024 * 1024
+HAS_QUICKACK = hasattr(socket, "TCP_QUICKACK")  # Linux only
+PR_SET_PDEATHSIG = 1  # <sys/prctl.h>
+
+
+class CacheProtocol(asyncio.BufferedProtocol):
+    """
+    One instance per connection, all driven by a single event loop.
+    The transport recv_into()s directly into the ProtocolHandler's buffer.
+    """
+    def __init__(self, cache: ShardedCache):
+        self.cache = cache
+        self.transport = None
+        self.handler = None  # type: ProtocolHandler
+
+    def connection_made(self, transport):
+        self.transport = transport
+        sock = transport.get_extra_info("socket")
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCK_BUF_BYTES)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCK_BUF_BYTES)
+            if HAS_QUICKACK:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
+        self.handler = ProtocolHandler(self.cache, transport.writelines)
+
+    def get_buffer(self, sizehint: int) -> memoryview:
+        return self.handler.get_buffer(sizehint)
+
+    def buffer_updated(self, nbytes: int):
+        try:
+            self.handler.buffer_updated(nbytes)
+        except Exception:
+            # Let the connection drop silently; server keeps running
+            self.transport.close()
+
+    # write back-pressure: while the transport's send buffer is over its high-water
+    # mark, stop reading and parsing instead of queueing more replies
+    def pause_writing(self):
+        self.handler.paused = True
+        self.transport.pause_reading()
+
+    def resume_writing(self):
+        self.transport.resume_reading()
         try:
-            conn.sendall(data)
+            self.handler.resume()  # may pause again if the backlog refills the buffer
         except Exception:
-            pass
-    handler = ProtocolHandler(cache, send)
+            self.transport.close()
+
+    def connection_lost(self, exc):
+        self.transport = None
+        self.handler = None
+
+
+def run_worker(host: str, port: int, capacity_mb: int, reuse_port: bool = False):
+    """One event loop and one cache, serving until interrupted."""
+    cache = ShardedCache(capacity_bytes=capacity_mb * 1024 * 1024)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    server = loop.run_until_complete(
+        loop.create_server(lambda: CacheProtocol(cache), host, port,
+                           reuse_address=True, reuse_port=reuse_port, backlog=2048)
+    )
+    worker = f", worker pid={os.getpid()}" if reuse_port else ""
+    print(f"Cache server listening on {host}:{port} (capacity={capacity_mb} MB{worker})")
     try:
-        with conn:
-            while True:
-                data = conn.recv(65536)
-                if not data:
-                    break
-                handler.on_data(data)
-    except Exception:
-        # Let the connection drop silently; server keeps running
-        pass
-
-
-def serve(host: str, port: int, capacity_mb: int):
-    cache = LRUCache(capacity_bytes=capacity_mb * 1024 * 1024)
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        s.bind((host, port))
-        s.listen(512)
-        print(f"Cache server listening on {host}:{port} (capacity={capacity_mb} MB)")
-        while True:
-            conn, addr = s.accept()
-            t = threading.Thread(target=handle_client, args=(cache, conn, addr), daemon=True)
-            t.start()
+        loop.run_forever()
+    finally:
+        server.close()
+        loop.run_until_complete(server.wait_closed())
+        loop.close()
+
+
+def check_port_free(host: str, port: int):
+    """
+    Plain bind (no SO_REUSEPORT) on every address create_server() would use;
+    raises OSError(EADDRINUSE) if something already listens there. Workers bind
+    with SO_REUSEPORT, which would otherwise silently join another reuse-port
+    listener's group (e.g. a second --workers server) instead of failing.
+    """
+    for family, type_, proto, _, addr in socket.getaddrinfo(
+            host, port, type=socket.SOCK_STREAM, flags=socket.AI_PASSIVE):
+        with socket.socket(family, type_, proto) as s:
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)  # as create_server does
+            if family == socket.AF_INET6:
+                s.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 1)
+            s.bind(addr)
+
+
+def die_with_parent(parent_pid: int):
+    """Linux: have the kernel SIGTERM this worker when the parent dies, even by SIGKILL."""
+    try:
+        ctypes.CDLL(None).prctl(PR_SET_PDEATHSIG, signal.SIGTERM)
+    except (OSError, AttributeError):
+        return  # no prctl: orphaned workers keep serving until killed
+    if os.getppid() != parent_pid:
+        os.kill(os.getpid(), signal.SIGTERM)  # parent died before prctl took effect
+
+
+def serve(host: str, port: int, capacity_mb: int, workers: int = 1):
+    """
+    workers > 1 forks that many processes, each binding its own SO_REUSEPORT
+    listener so the kernel spreads connections across them (one GIL each).
+    Workers share nothing: each has its own cache of capacity_mb, and a key is
+    only visible to connections that land on the same worker.
+    The port is checked with a plain bind first, so an existing listener (even
+    another reuse-port server) is an error. If a worker dies on its own, the
+    others are stopped and the parent exits 1; if the parent is killed, Linux
+    workers get SIGTERM too.
+    """
+    if uvloop is not None:
+        uvloop.install()
+    if workers <= 1:
+        run_worker(host, port, capacity_mb)
+        return
+    check_port_free(host, port)
+    parent_pid = os.getpid()
+    pids = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                die_with_parent(parent_pid)
+                run_worker(host, port, capacity_mb, reuse_port=True)
+            except KeyboardInterrupt:
+                pass
+            except BaseException:
+                traceback.print_exc()  # e.g. the port is already bound
+                code = 1
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)  # never fall back into the parent's code
+        pids.append(pid)
+
+    stopping = False
+
+    def stop_workers(signum=None, frame=None):
+        nonlocal stopping
+        stopping = True
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop_workers)
+    failed = False
+    while pids:
+        try:
+            pid, status = os.wait()
+        except KeyboardInterrupt:
+            stop_workers()
+            continue
+        pids.remove(pid)
+        code = os.waitstatus_to_exitcode(status)
+        if code != 0 and not stopping:
+            # a worker that dies on its own (startup failure or crash) takes
+            # the whole server down rather than leaving it partially serving
+            print(f"worker pid={pid} exited with status {code}; stopping", file=sys.stderr)
+            failed = True
+            stop_workers()
+    if failed:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -44,5 +187,7 @@ if __name__ == "__main__":
     ap.add_argument("--host", default="0.0.0.0")
     ap.add_argument("--port", type=int, default=9000)
     ap.add_argument("--capacity-mb", type=int, default=64)
+    ap.add_argument("--workers", type=int, default=1,
+                    help="SO_REUSEPORT worker processes, each with its own cache")
     args = ap.parse_args()
-    serve(args.host, args.port, args.capacity_mb)
+    serve(args.host, args.port, args.capacity_mb, args.workers)
@@ -1,6 +1,8 @@
 
+import json
 import time
-from cache import LRUCache
+from cache import LRUCache, ShardedCache
+from protocol import ProtocolHandler
 
 def test_basic():
     c = LRUCache(1024*1024)
@@ -15,6 +17,13 @@ def test_ttl():
     assert c.get("k") == b"v"
     time.sleep(0.06)
     assert c.get("k") is None  # expired
+    # TTLs beyond the int64 nanosecond clock (~292 years) never expire; the
+    # compiled build must clamp them rather than overflow mid-update
+    c.set("k", b"old", ttl_sec=60)
+    c.set("k", b"new", ttl_sec=1e10)
+    c.set("n", b"v", ttl_sec=float("inf"))
+    assert c.get("k") == b"new" and c.get("n") == b"v"
+    assert c._timers == 0 and c.sets == 4
 
 def test_eviction():
     c = LRUCache(32)  # tiny
@@ -28,8 +37,87 @@ def test_eviction():
     c.set("c", b"xxxxxxxxxxxx")  # force evict LRU ('b')
     assert c.get("b") is None
 
+def test_timer_wheel():
+    c = LRUCache(1024*1024)
+    c.set("short", b"v", ttl_sec=0.05)
+    c.set("long", b"v", ttl_sec=5)   # lands in an upper wheel
+    c.set("gone", b"v", ttl_sec=0.05)
+    c.set("gone", b"v")              # overwrite cancels the timer
+    time.sleep(0.07)
+    c.set("other", b"v")         # SET reclaims due entries inline
+    assert c.stats()["expired"] == 1
+    assert b"short" not in c.data
+    assert c.get("long") == b"v"
+    assert c.get("gone") == b"v"
+    assert c._timers == 1
+    assert not c._due
+
+def test_sharded():
+    c = ShardedCache(1024*1024, shards=4)
+    for i in range(100):
+        c.set(f"k{i}", b"v")
+    assert c.get("k42") == b"v"
+    assert c.delete("k42") == 1
+    assert c.get("k42") is None
+    s = c.stats()
+    assert s["keys"] == 99
+    assert s["sets"] == 100
+    assert s["capacity"] == 1024*1024
+
+def test_protocol_split_reads():
+    out = []
+    h = ProtocolHandler(LRUCache(1024*1024), out.extend)
+    msg = b"SET a 0 3\nxyz\nGET a\nDEL a\nGET a\n"
+    for i in range(len(msg)):  # one byte per read
+        h.on_data(msg[i:i+1])
+    assert b"".join(out) == b"OK\nVALUE 3\nxyz\nDELETED 1\nNOT_FOUND\n"
+    sends = []
+    h = ProtocolHandler(LRUCache(1024*1024), sends.append)
+    h.on_data(msg)  # pipelined: every reply goes out in one send
+    assert len(sends) == 1 and b"".join(sends[0]) == b"".join(out)
+    out.clear()
+    h = ProtocolHandler(LRUCache(1024*1024), out.extend)
+    h.on_data(b"STATS\n")
+    assert json.loads(b"".join(out)[len(b"STATS "):]) == h.cache.stats()
+
+def test_protocol_large_value():
+    out = []
+    c = LRUCache(1024*1024)
+    h = ProtocolHandler(c, out.extend)
+    val = bytes(range(256)) * 200  # above ZERO_COPY_MIN
+    msg = b"SET big 0 %d\n" % len(val) + val + b"\nGET big\n"
+    for i in range(0, len(msg), 7000):
+        h.on_data(msg[i:i+7000])
+    assert b"".join(out) == b"OK\nVALUE %d\n" % len(val) + val + b"\n"
+    assert isinstance(c.get("big"), memoryview)  # kept without a copy
+
+def test_protocol_value_limits():
+    out = []
+    c = LRUCache(1024*1024)
+    h = ProtocolHandler(c, out.extend)
+    val = bytes(range(256)) * 1000  # larger than one recv window: buffer grows
+    msg = (b"SET big 0 %d\n" % len(val) + val + b"\n" +
+           b"SET huge 0 %d\n" % (2*1024*1024) + b"x" * (2*1024*1024) + b"\nGET big\n")
+    for i in range(0, len(msg), 50000):
+        h.on_data(msg[i:i+50000])
+    assert b"".join(out) == b"OK\nERR value too large\nVALUE %d\n" % len(val) + val + b"\n"
+    assert c.get("huge") is None
+    # the key counts toward the entry: capacity - len(key) fits, one more byte does not
+    out.clear()
+    c = LRUCache(1024*1024)
+    h = ProtocolHandler(c, out.extend)
+    for nbytes in (1024*1024, 1024*1024 - 1):
+        h.on_data(b"SET k 0 %d\n" % nbytes + b"x" * nbytes + b"\n")
+    assert b"".join(out) == b"ERR value too large\nOK\n"
+    assert len(c.get("k")) == 1024*1024 - 1 and c.evictions == 0
+
 if __name__ == "__main__":
     test_basic()
     test_ttl()
     test_eviction()
+    test_timer_wheel()
+    test_sharded()
+    test_protocol_split_reads()
+    test_protocol_large_value()
+    test_protocol_value_limits()
     print("OK")